@@ -1,19 +1,10 @@
 from flask import Flask, render_template, request, redirect, url_for, flash
 from datetime import datetime, date, timedelta
-import sqlite3
 import os 
-from dotenv import load_dotenv
 import requests
-import json
-import psycopg2 
-from psycopg2.extras import RealDictCursor
-
-DATABASE_URL = os.getenv('DATABASE_URL')
-
-
-load_dotenv()
-
-
+import queries
+from shopping_optimizer import ShoppingPlanner
+from recipe_details import get_recipe_details
 
 
 # Create the Flask app
@@ -22,69 +13,15 @@ app.secret_key = 'your-secret-key-here-change-in-production'
 
 # Get API key from environment variable (production) or hardcode (development)
 SPOONACULAR_API_KEY = os.getenv('SPOONACULAR_API_KEY', 'your-api-key-here')
-
-# Check if we're on Render (production) or local (development)
-DATABASE_URL = os.getenv('DATABASE_URL')
-
-if DATABASE_URL:
-    # Production: Use PostgreSQL
-    import psycopg2
-    from psycopg2.extras import RealDictCursor
-    
-    def get_db_connection():
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
-else:
-    # Development: Use SQLite
-    def get_db_connection():
-        conn = sqlite3.connect('fridge.db')
-        conn.row_factory = sqlite3.Row
-        return conn
-
-# Helper functions for database operations
-def execute_query(conn, query, params=None):
-    """Execute a SELECT query and return results"""
-    if DATABASE_URL:
-        # PostgreSQL
-        cursor = conn.cursor()
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
-        
-        # Get column names
-        columns = [desc[0] for desc in cursor.description] if cursor.description else []
-        
-        # Fetch results and convert to dict
-        results = []
-        for row in cursor.fetchall():
-            results.append(dict(zip(columns, row)))
-        
-        cursor.close()
-        return results
-    else:
-        # SQLite
-        if params:
-            return conn.execute(query, params).fetchall()
-        else:
-            return conn.execute(query).fetchall()
-
-def execute_insert(conn, query, params):
-    """Execute an INSERT/UPDATE/DELETE query"""
-    if DATABASE_URL:
-        # PostgreSQL
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        cursor.close()
-    else:
-        # SQLite
-        conn.execute(query, params)
+SPOONACULAR_BASE_URL = os.getenv('SPOONACULAR_BASE_URL', 'https://api.spoonacular.com')
+# Seconds to wait for the recipe search before giving up
+SPOONACULAR_TIMEOUT = float(os.getenv('SPOONACULAR_TIMEOUT', 10))
 
 def init_db():
     """Initialize the database with tables"""
-    conn = get_db_connection()
+    conn = queries.get_db_connection()
     
-    if DATABASE_URL:
+    if queries.DATABASE_URL:
         # PostgreSQL syntax
         cursor = conn.cursor()
         cursor.execute('''
@@ -139,14 +76,14 @@ def init_db():
         ''')
         conn.commit()
     
-    conn.close()
+    queries.release_db_connection(conn)
 
 def migrate_db():
     """Add status, price, and store columns if they don't exist"""
-    conn = get_db_connection()
+    conn = queries.get_db_connection()
     
     try:
-        if DATABASE_URL:
+        if queries.DATABASE_URL:
             # PostgreSQL - use cursor
             cursor = conn.cursor()
             
@@ -196,14 +133,14 @@ def migrate_db():
                 print("Database migrated: added store column")
                 
     finally:
-        conn.close()
+        queries.release_db_connection(conn)
 
 def init_price_history_table():
     """Create price_history table if it doesn't exist"""
-    conn = get_db_connection()
+    conn = queries.get_db_connection()
     
     try:
-        if DATABASE_URL:
+        if queries.DATABASE_URL:
             # PostgreSQL
             cursor = conn.cursor()
             cursor.execute('''
@@ -234,12 +171,47 @@ def init_price_history_table():
             conn.commit()
             print("Price history table initialized")
     finally:
-        conn.close()
+        queries.release_db_connection(conn)
+
+def init_recipe_details_table():
+    """Create recipe_details cache table if it doesn't exist"""
+    conn = queries.get_db_connection()
+    
+    try:
+        # Same DDL on both databases
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS recipe_details (
+                recipe_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                fetched_at TEXT NOT NULL
+            )
+        ''')
+        conn.commit()
+        cursor.close()
+    finally:
+        queries.release_db_connection(conn)
 
 # Initialize the database when the app starts
 init_db()
 migrate_db()
 init_price_history_table()
+init_recipe_details_table()
+
+# Shopping trip planner keeps the latest price per item/store in memory
+shopping_planner = ShoppingPlanner()
+
+# On PostgreSQL, ids from concurrent inserts can commit out of order, so a
+# lower id may show up after a higher one was already loaded. Each refresh
+# re-reads this many ids below the newest one seen; rows already in the
+# index are ignored.
+PRICE_REFRESH_WINDOW = 100
+
+def refresh_price_index(conn):
+    """Load recently added price_history rows into the planner"""
+    after = max(shopping_planner.index.last_id - PRICE_REFRESH_WINDOW, 0)
+    rows = queries.query(conn, queries.PRICES_SINCE, last_id=after)
+    shopping_planner.apply_prices(rows)
 
 # Helper function to calculate days until expiration
 def calculate_days_left(expiration_date_str):
@@ -255,20 +227,17 @@ def calculate_days_left(expiration_date_str):
 @app.route('/')
 def home():
     """Display all fridge items"""
-    conn = get_db_connection()
+    conn = queries.get_db_connection()
     try:
-        items = execute_query(conn, "SELECT * FROM fridge_items WHERE status = 'fridge' ORDER BY expiration")
+        items = queries.query(conn, queries.FRIDGE_ITEMS)
         
         # Add days_left calculation to each item
-        items_with_days = []
         for item in items:
-            item_dict = dict(item)
-            item_dict['days_left'] = calculate_days_left(item_dict['expiration'])
-            items_with_days.append(item_dict)
+            item.days_left = calculate_days_left(item.expiration)
         
-        return render_template('home.html', items=items_with_days)
+        return render_template('home.html', items=items)
     finally:
-        conn.close()
+        queries.release_db_connection(conn)
 
 @app.route('/add', methods=['POST'])
 def add_item():
@@ -296,46 +265,35 @@ def add_item():
     if not store or store.strip() == '':
         store = None
     
-    conn = get_db_connection()
+    conn = queries.get_db_connection()
     try:
-        execute_insert(conn, 
-            '''INSERT INTO fridge_items 
-               (name, quantity, category, expiration, location, status, price, store) 
-               VALUES (%s, %s, %s, %s, %s, %s, %s, %s)''' if DATABASE_URL else
-            '''INSERT INTO fridge_items 
-               (name, quantity, category, expiration, location, status, price, store) 
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-            (item_name, quantity, category, expiration_date, location, 'fridge', price, store)
+        queries.execute(conn, queries.INSERT_ITEM,
+            name=item_name, quantity=quantity, category=category, expiration=expiration_date,
+            location=location, status='fridge', price=price, store=store
         )
         
         # If item has a price, log it in price history
         if price is not None and item_name and store:
-            execute_insert(conn,
-                '''INSERT INTO price_history (item_name, store, price, date_recorded)
-                   VALUES (%s, %s, %s, %s)''' if DATABASE_URL else
-                '''INSERT INTO price_history (item_name, store, price, date_recorded)
-                   VALUES (?, ?, ?, ?)''',
-                (item_name, store, price, date.today().strftime('%Y-%m-%d'))
+            queries.execute(conn, queries.INSERT_PRICE,
+                item_name=item_name, store=store, price=price,
+                date_recorded=date.today().strftime('%Y-%m-%d')
             )
         
         conn.commit()
     finally:
-        conn.close()
+        queries.release_db_connection(conn)
     
     return redirect(url_for('home'))
 
 @app.route('/delete/<int:item_id>', methods=['POST'])
 def delete_item(item_id):
     """Delete an item from the fridge"""
-    conn = get_db_connection()
+    conn = queries.get_db_connection()
     try:
-        execute_insert(conn, 
-            'DELETE FROM fridge_items WHERE id = %s' if DATABASE_URL else 'DELETE FROM fridge_items WHERE id = ?',
-            (item_id,)
-        )
+        queries.execute(conn, queries.DELETE_ITEM, id=item_id)
         conn.commit()
     finally:
-        conn.close()
+        queries.release_db_connection(conn)
     
     # Redirect back to where they came from
     referrer = request.referrer
@@ -347,50 +305,48 @@ def delete_item(item_id):
 @app.route('/move-to-shopping/<int:item_id>', methods=['POST'])
 def move_to_shopping_list(item_id):
     """Move an item to the shopping list"""
-    conn = get_db_connection()
+    conn = queries.get_db_connection()
     try:
-        execute_insert(conn,
-            "UPDATE fridge_items SET status = %s WHERE id = %s" if DATABASE_URL else
-            "UPDATE fridge_items SET status = ? WHERE id = ?",
-            ('shopping_list', item_id)
-        )
+        queries.execute(conn, queries.SET_ITEM_STATUS, status='shopping_list', id=item_id)
         conn.commit()
         flash('Item moved to shopping list!', 'success')
     finally:
-        conn.close()
+        queries.release_db_connection(conn)
     
     return redirect(url_for('home'))
 
 @app.route('/shopping-list')
 def shopping_list():
     """Display shopping list"""
-    conn = get_db_connection()
+    conn = queries.get_db_connection()
     try:
-        items = execute_query(conn, "SELECT * FROM fridge_items WHERE status = 'shopping_list'")
-        return render_template('shopping_list.html', items=items)
+        items = queries.query(conn, queries.SHOPPING_LIST_ITEMS)
+        
+        # Work out the cheapest way to buy the list from price history
+        refresh_price_index(conn)
+        plan = shopping_planner.plan(items)
+        
+        return render_template('shopping_list.html', items=items, plan=plan)
     finally:
-        conn.close()
+        queries.release_db_connection(conn)
 
 @app.route('/mark-purchased/<int:item_id>', methods=['POST'])
 def mark_purchased(item_id):
     """Mark an item as purchased and remove from shopping list"""
-    conn = get_db_connection()
+    conn = queries.get_db_connection()
     try:
-        execute_insert(conn,
-            'DELETE FROM fridge_items WHERE id = %s' if DATABASE_URL else 'DELETE FROM fridge_items WHERE id = ?',
-            (item_id,)
-        )
+        queries.execute(conn, queries.DELETE_ITEM, id=item_id)
         conn.commit()
         flash('Item marked as purchased!', 'success')
     finally:
-        conn.close()
+        queries.release_db_connection(conn)
     
     return redirect(url_for('shopping_list'))
 
 @app.route('/edit/<int:item_id>', methods=['GET', 'POST'])
 def edit_item(item_id):
     """Edit an existing item"""
-    conn = get_db_connection()
+    conn = queries.get_db_connection()
     
     if request.method == 'POST':
         item_name = request.form.get('item_name')
@@ -416,37 +372,23 @@ def edit_item(item_id):
         
         try:
             # Get old item data to check if price changed
-            old_item = execute_query(conn,
-                'SELECT price, store, name FROM fridge_items WHERE id = %s' if DATABASE_URL else
-                'SELECT price, store, name FROM fridge_items WHERE id = ?',
-                (item_id,)
-            )
+            old_item = queries.query(conn, queries.GET_ITEM, id=item_id)
             
             if old_item:
                 old_item = old_item[0]
             
             # Update the item
-            execute_insert(conn,
-                '''UPDATE fridge_items 
-                   SET name = %s, quantity = %s, category = %s, expiration = %s, 
-                       location = %s, price = %s, store = %s
-                   WHERE id = %s''' if DATABASE_URL else
-                '''UPDATE fridge_items 
-                   SET name = ?, quantity = ?, category = ?, expiration = ?, 
-                       location = ?, price = ?, store = ?
-                   WHERE id = ?''',
-                (item_name, quantity, category, expiration_date, location, price, store, item_id)
+            queries.execute(conn, queries.UPDATE_ITEM,
+                name=item_name, quantity=quantity, category=category, expiration=expiration_date,
+                location=location, price=price, store=store, id=item_id
             )
             
             # If price changed and exists, log new price in history
             if price is not None and store and item_name and old_item:
-                if old_item['price'] != price:
-                    execute_insert(conn,
-                        '''INSERT INTO price_history (item_name, store, price, date_recorded)
-                           VALUES (%s, %s, %s, %s)''' if DATABASE_URL else
-                        '''INSERT INTO price_history (item_name, store, price, date_recorded)
-                           VALUES (?, ?, ?, ?)''',
-                        (item_name, store, price, date.today().strftime('%Y-%m-%d'))
+                if old_item.price != price:
+                    queries.execute(conn, queries.INSERT_PRICE,
+                        item_name=item_name, store=store, price=price,
+                        date_recorded=date.today().strftime('%Y-%m-%d')
                     )
             
             conn.commit()
@@ -459,20 +401,17 @@ def edit_item(item_id):
             else:
                 return redirect(url_for('home'))
         finally:
-            conn.close()
+            queries.release_db_connection(conn)
     
     # GET request - show edit form
     try:
-        item = execute_query(conn, 
-            'SELECT * FROM fridge_items WHERE id = %s' if DATABASE_URL else 'SELECT * FROM fridge_items WHERE id = ?',
-            (item_id,)
-        )
+        item = queries.query(conn, queries.GET_ITEM, id=item_id)
         if not item:
             flash('Item not found!', 'error')
             return redirect(url_for('home'))
         return render_template('edit_item.html', item=item[0])
     finally:
-        conn.close()
+        queries.release_db_connection(conn)
 
 @app.route('/bulk-add', methods=['GET', 'POST'])
 def bulk_add():
@@ -480,7 +419,7 @@ def bulk_add():
     if request.method == 'POST':
         item_count = int(request.form.get('item_count', 0))
         
-        conn = get_db_connection()
+        conn = queries.get_db_connection()
         try:
             items_added = 0
             
@@ -511,24 +450,16 @@ def bulk_add():
                     store = None
                 
                 # Insert the item
-                execute_insert(conn,
-                    '''INSERT INTO fridge_items 
-                       (name, quantity, category, expiration, location, status, price, store) 
-                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s)''' if DATABASE_URL else
-                    '''INSERT INTO fridge_items 
-                       (name, quantity, category, expiration, location, status, price, store) 
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                    (item_name, quantity, category, expiration_date, location, 'fridge', price, store)
+                queries.execute(conn, queries.INSERT_ITEM,
+                    name=item_name, quantity=quantity, category=category, expiration=expiration_date,
+                    location=location, status='fridge', price=price, store=store
                 )
                 
                 # Log price history if price exists
                 if price is not None and item_name and store:
-                    execute_insert(conn,
-                        '''INSERT INTO price_history (item_name, store, price, date_recorded)
-                           VALUES (%s, %s, %s, %s)''' if DATABASE_URL else
-                        '''INSERT INTO price_history (item_name, store, price, date_recorded)
-                           VALUES (?, ?, ?, ?)''',
-                        (item_name, store, price, date.today().strftime('%Y-%m-%d'))
+                    queries.execute(conn, queries.INSERT_PRICE,
+                        item_name=item_name, store=store, price=price,
+                        date_recorded=date.today().strftime('%Y-%m-%d')
                     )
                 
                 items_added += 1
@@ -538,7 +469,7 @@ def bulk_add():
             return redirect(url_for('home'))
             
         finally:
-            conn.close()
+            queries.release_db_connection(conn)
     
     # GET request - show the form
     default_expiration = (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d')
@@ -547,43 +478,25 @@ def bulk_add():
 @app.route('/price-history')
 def price_history():
     """Show price history and trends"""
-    conn = get_db_connection()
+    conn = queries.get_db_connection()
     try:
         # Get all price history, most recent first
-        history = execute_query(conn,
-            '''SELECT item_name, store, price, date_recorded 
-               FROM price_history 
-               ORDER BY date_recorded DESC'''
-        )
+        history = queries.query(conn, queries.PRICE_HISTORY)
         
         # Get unique items that have price history
-        items_with_history = execute_query(conn,
-            '''SELECT DISTINCT item_name, store 
-               FROM price_history 
-               ORDER BY item_name'''
-        )
+        items_with_history = queries.query(conn, queries.PRICED_ITEM_STORES)
         
         # Calculate average prices per item per store
         averages = {}
         for item_store in items_with_history:
-            item_name = item_store['item_name']
-            store = item_store['store']
+            item_name = item_store.item_name
+            store = item_store.store
             
             # Get all prices for this item at this store
-            prices = execute_query(conn,
-                '''SELECT price, date_recorded 
-                   FROM price_history 
-                   WHERE item_name = %s AND store = %s
-                   ORDER BY date_recorded DESC''' if DATABASE_URL else
-                '''SELECT price, date_recorded 
-                   FROM price_history 
-                   WHERE item_name = ? AND store = ?
-                   ORDER BY date_recorded DESC''',
-                (item_name, store)
-            )
+            prices = queries.query(conn, queries.PRICES_FOR_ITEM_AT_STORE, item_name=item_name, store=store)
             
             if prices:
-                price_list = [p['price'] for p in prices]
+                price_list = [p.price for p in prices]
                 avg_price = sum(price_list) / len(price_list)
                 min_price = min(price_list)
                 max_price = max(price_list)
@@ -614,7 +527,7 @@ def price_history():
                              history=history, 
                              averages=averages)
     finally:
-        conn.close()
+        queries.release_db_connection(conn)
 
 # Recipe helper function
 def get_recipes(ingredients, number=12):
@@ -622,7 +535,7 @@ def get_recipes(ingredients, number=12):
     if not ingredients:
         return []
     
-    url = 'https://api.spoonacular.com/recipes/findByIngredients'
+    url = f'{SPOONACULAR_BASE_URL}/recipes/findByIngredients'
     params = {
         'ingredients': ','.join(ingredients),
         'number': number,
@@ -632,7 +545,7 @@ def get_recipes(ingredients, number=12):
     }
     
     try:
-        response = requests.get(url, params=params)
+        response = requests.get(url, params=params, timeout=SPOONACULAR_TIMEOUT)
         if response.status_code == 200:
             return response.json()
         else:
@@ -643,48 +556,48 @@ def get_recipes(ingredients, number=12):
 @app.route('/recipes')
 def recipes():
     """Show recipe suggestions based on fridge items"""
-    conn = get_db_connection()
+    conn = queries.get_db_connection()
     try:
-        items = execute_query(conn, "SELECT * FROM fridge_items WHERE status = 'fridge'")
-        
-        # Get ingredient names
-        ingredients = [item['name'] for item in items]
-        
-        # Get recipe suggestions
-        recipes_data = get_recipes(ingredients, number=12)
-        
-        return render_template('recipes.html', 
-                             recipes=recipes_data, 
-                             ingredients=ingredients)
+        items = queries.query(conn, queries.FRIDGE_ITEMS)
     finally:
-        conn.close()
+        # Don't hold a database connection while waiting on the API
+        queries.release_db_connection(conn)
+    
+    # Get ingredient names
+    ingredients = [item.name for item in items]
+    
+    # Get recipe suggestions
+    recipes_data = get_recipes(ingredients, number=12)
+    
+    # Instructions, nutrition and price per serving (cached by recipe ID)
+    details = get_recipe_details([recipe['id'] for recipe in recipes_data],
+                                 SPOONACULAR_API_KEY, SPOONACULAR_BASE_URL)
+    
+    return render_template('recipes.html', 
+                         recipes=recipes_data, 
+                         details=details,
+                         ingredients=ingredients)
 
 @app.route('/add-missing-ingredients', methods=['POST'])
 def add_missing_ingredients():
     """Add missing recipe ingredients to shopping list"""
     ingredients = request.form.getlist('ingredients')
     
-    conn = get_db_connection()
+    # Same placeholder expiration on both databases
+    expiration = (date.today() + timedelta(days=7)).strftime('%Y-%m-%d')
+    
+    conn = queries.get_db_connection()
     try:
         added_count = 0
         for ingredient in ingredients:
             # Check if already in shopping list
-            existing = execute_query(conn,
-                "SELECT id FROM fridge_items WHERE name = %s AND status = 'shopping_list'" if DATABASE_URL else
-                "SELECT id FROM fridge_items WHERE name = ? AND status = 'shopping_list'",
-                (ingredient,)
-            )
+            existing = queries.query(conn, queries.SHOPPING_ITEM_BY_NAME, name=ingredient)
             
             if not existing:
                 # Add to shopping list
-                execute_insert(conn,
-                    '''INSERT INTO fridge_items 
-                       (name, quantity, category, expiration, location, status) 
-                       VALUES (%s, 1, 'Other', %s, 'Fridge', 'shopping_list')''' if DATABASE_URL else
-                    '''INSERT INTO fridge_items 
-                       (name, quantity, category, expiration, location, status) 
-                       VALUES (?, 1, 'Other', date('now', '+7 days'), 'Fridge', 'shopping_list')''',
-                    (ingredient, (date.today() + timedelta(days=7)).strftime('%Y-%m-%d')) if DATABASE_URL else (ingredient,)
+                queries.execute(conn, queries.INSERT_ITEM,
+                    name=ingredient, quantity=1, category='Other', expiration=expiration,
+                    location='Fridge', status='shopping_list', price=None, store=None
                 )
                 added_count += 1
         
@@ -696,7 +609,7 @@ def add_missing_ingredients():
             flash('All ingredients already in shopping list!', 'info')
         
     finally:
-        conn.close()
+        queries.release_db_connection(conn)
     
     return redirect(url_for('recipes'))
 
@@ -0,0 +1,92 @@
+"""Benchmark for the shopping trip planner.
+
+Run with: python bench_shopping_optimizer.py
+"""
+import random
+import time
+
+from queries import FridgeItem, PriceRecord
+from shopping_optimizer import ShoppingPlanner
+
+ITEMS = 500
+STORES = 20
+PRICE_POINTS = 10000
+RUNS = 20
+
+
+def make_price_rows(rng):
+    """Random price_history rows spread over a month"""
+    rows = []
+    for row_id in range(1, PRICE_POINTS + 1):
+        rows.append(PriceRecord(
+            id=row_id,
+            item_name=f'Item {rng.randrange(ITEMS)}',
+            store=f'Store {rng.randrange(STORES)}',
+            price=round(rng.uniform(0.5, 20), 2),
+            date_recorded=f'2025-10-{rng.randint(1, 30):02d}',
+            notes=None,
+        ))
+    return rows
+
+
+def timed(label, func, runs=RUNS):
+    """Print the best and average time of func in milliseconds"""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    print(f'{label:<32} best {min(times):8.2f} ms   avg {sum(times) / len(times):8.2f} ms')
+
+
+def main():
+    rng = random.Random(42)
+    rows = make_price_rows(rng)
+    items = [
+        FridgeItem(id=i, name=f'item {i}', quantity=rng.randint(1, 3), category='Other',
+                   expiration='2025-11-01', location='Fridge', status='shopping_list',
+                   price=None, store=None)
+        for i in range(ITEMS)
+    ]
+    print(f'{ITEMS} list items, {STORES} stores, {PRICE_POINTS} price points\n')
+
+    def cold():
+        planner = ShoppingPlanner()
+        planner.apply_prices(rows)
+        planner.plan(items)
+
+    planner = ShoppingPlanner()
+    planner.apply_prices(rows)
+    planner.plan(items)
+
+    next_id = [PRICE_POINTS]
+
+    def price_change():
+        next_id[0] += 1
+        planner.apply_prices([PriceRecord(
+            id=next_id[0],
+            item_name=f'Item {rng.randrange(ITEMS)}',
+            store=f'Store {rng.randrange(STORES)}',
+            price=round(rng.uniform(0.5, 20), 2),
+            date_recorded='2025-10-31',
+            notes=None,
+        )])
+        planner.plan(items)
+
+    # Every call plans a different list from the one before, like an item
+    # being added to or removed from the shopping list
+    lists = [items, items[:-1]]
+    list_calls = [0]
+
+    def list_change():
+        list_calls[0] += 1
+        planner.plan(lists[list_calls[0] % 2])
+
+    timed('cold: index + plan', cold)
+    timed('cached plan', lambda: planner.plan(items))
+    timed('one new price + replan', price_change)
+    timed('list changed + replan', list_change)
+
+
+if __name__ == '__main__':
+    main()
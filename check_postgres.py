@@ -0,0 +1,171 @@
+"""Check the PostgreSQL side of queries.py against a real server.
+
+Run with: DATABASE_URL=postgresql://... python check_postgres.py
+
+Everything happens in a throwaway schema that is dropped at the end, but
+point it at a scratch database anyway. Checks that every route works
+through prepared statements, that list parameters are sent as arrays, and
+that the connection pool waits instead of failing and drops dead
+connections.
+"""
+import os
+import sys
+import threading
+import time
+import uuid
+
+SCHEMA = f'fridge_check_{uuid.uuid4().hex[:8]}'
+
+
+def main():
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        sys.exit('Set DATABASE_URL to a scratch PostgreSQL database to run this check.')
+
+    import psycopg2
+
+    setup = psycopg2.connect(database_url)
+    setup.autocommit = True
+    setup.cursor().execute(f'CREATE SCHEMA {SCHEMA}')
+
+    # libpq reads PGOPTIONS, so every connection the app opens uses the schema
+    os.environ['PGOPTIONS'] = f'-c search_path={SCHEMA}'
+    os.environ['DB_POOL_SIZE'] = '3'
+    try:
+        run_checks()
+    finally:
+        setup.cursor().execute(f'DROP SCHEMA {SCHEMA} CASCADE')
+        setup.close()
+    print('ok')
+
+
+def run_checks():
+    import queries
+    assert queries.DIALECT == 'postgres', queries.DIALECT
+
+    import app
+
+    client = app.app.test_client()
+
+    # Every route, through PREPARE/EXECUTE
+    for name, price, store in [('Milk', '3.5', 'Aldi'), ('milk', '4', 'Giant'), ('Eggs', '2', 'Giant')]:
+        response = client.post('/add', data={
+            'item_name': name, 'quantity': '2', 'category': 'Dairy',
+            'expiration_date': '2030-01-01', 'location': 'Fridge', 'price': price, 'store': store})
+        assert response.status_code == 302, response.status_code
+    assert client.get('/').status_code == 200
+    assert client.get('/edit/1').status_code == 200
+    response = client.post('/edit/1', data={
+        'item_name': 'Milk', 'quantity': '2', 'category': 'Dairy',
+        'expiration_date': '2030-01-01', 'location': 'Fridge', 'price': '3.0', 'store': 'Aldi'})
+    assert response.status_code == 302, response.status_code
+    for item_id in (1, 2, 3):
+        client.post(f'/move-to-shopping/{item_id}')
+    html = client.get('/shopping-list').data.decode()
+    assert 'Trip Planner' in html and '$16.00' in html, 'trip plan missing'
+    assert client.get('/price-history').status_code == 200
+    client.post('/bulk-add', data={'item_count': '1', 'item_name_0': 'Jam', 'price_0': '4',
+                                   'store_0': 'Aldi', 'expiration_0': '2030-01-01'})
+    client.post('/add-missing-ingredients', data={'ingredients': ['salt', 'Eggs']})
+    client.post('/mark-purchased/2')
+    client.post('/delete/4')
+
+    conn = queries.get_db_connection()
+    try:
+        names = [item.name for item in queries.query(conn, queries.SHOPPING_LIST_ITEMS)]
+        assert sorted(names) == ['Eggs', 'Milk', 'salt'], names
+        assert len(queries.query(conn, queries.PRICE_HISTORY)) == 5
+
+        # Statements really are prepared server-side
+        cursor = conn.cursor()
+        cursor.execute('SELECT name FROM pg_prepared_statements')
+        prepared = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+        assert prepared and prepared <= {s.name for s in vars(queries).values()
+                                         if isinstance(s, queries.Statement)}, prepared
+
+        # A rolled back transaction does not lose prepared statements
+        conn.rollback()
+        queries.query(conn, queries.GET_ITEM, id=1)
+
+        # List parameters, including an empty list
+        for recipe_id in (101, 102):
+            queries.execute(conn, queries.SAVE_RECIPE_DETAIL,
+                            recipe_id=recipe_id, data='{}', fetched_at='2030-01-01')
+        conn.commit()
+        rows = queries.query(conn, queries.GET_RECIPE_DETAILS, recipe_ids=[101, 102, 103])
+        assert sorted(row.recipe_id for row in rows) == [101, 102], rows
+        assert queries.query(conn, queries.GET_RECIPE_DETAILS, recipe_ids=[]) == []
+    finally:
+        queries.release_db_connection(conn)
+    print('routes, prepared statements and list parameters: ok')
+
+    check_pool(queries)
+
+
+def check_pool(queries):
+    import psycopg2
+
+    # More threads than connections: they wait for a slot instead of failing
+    lock = threading.Lock()
+    state = {'active': 0, 'peak': 0, 'errors': []}
+
+    def worker():
+        try:
+            conn = queries.get_db_connection()
+        except Exception as error:
+            state['errors'].append(error)
+            return
+        try:
+            with lock:
+                state['active'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+            queries.query(conn, queries.FRIDGE_ITEMS)
+            time.sleep(0.05)
+            with lock:
+                state['active'] -= 1
+        finally:
+            queries.release_db_connection(conn)
+
+    threads = [threading.Thread(target=worker) for _ in range(queries.POOL_SIZE * 4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not state['errors'], state['errors']
+    assert state['peak'] <= queries.POOL_SIZE, state['peak']
+    print(f"pool: {len(threads)} threads, peak {state['peak']} connections (size {queries.POOL_SIZE})")
+
+    # A connection closed on our side is discarded when it is handed back
+    conn = queries.get_db_connection()
+    conn.close()
+    queries.release_db_connection(conn)
+
+    # A connection the server killed fails once, then is discarded
+    conn = queries.get_db_connection()
+    killer = queries.get_db_connection()
+    cursor = killer.cursor()
+    cursor.execute('SELECT pg_terminate_backend(%s)', (conn.get_backend_pid(),))
+    cursor.close()
+    queries.release_db_connection(killer)
+    try:
+        queries.query(conn, queries.FRIDGE_ITEMS)
+        raise AssertionError('query on a terminated connection should fail')
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        pass
+    queries.release_db_connection(conn)
+
+    # Every connection handed out afterwards works
+    conns = [queries.get_db_connection() for _ in range(queries.POOL_SIZE)]
+    try:
+        for conn in conns:
+            assert not conn.closed
+            queries.query(conn, queries.FRIDGE_ITEMS)
+    finally:
+        for conn in conns:
+            queries.release_db_connection(conn)
+    print('pool: closed and terminated connections are replaced')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""Check the recipe detail pipeline against a local fake Spoonacular server.
+
+Run with: python check_recipe_details.py
+
+The fake server answers findByIngredients with 12 recipes. Each detail call
+takes DELAY seconds, except that one recipe hangs past the call timeout, one
+returns a 500 and one returns a JSON list instead of an object. Later views
+check that failed recipes are not asked for again while they cool down, and
+that a 402 (quota used up) stops all detail calls.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+RECIPES = 12
+DELAY = 0.3
+CALL_TIMEOUT = 1.0
+HANGING_ID = 12
+FAILING_ID = 11
+BAD_JSON_ID = 10
+BROKEN_IDS = {HANGING_ID, FAILING_ID, BAD_JSON_ID}
+
+
+class FakeSpoonacular(BaseHTTPRequestHandler):
+    """Answers the two Spoonacular endpoints the app uses"""
+
+    lock = threading.Lock()
+    # When set, every detail call answers 402 like an exhausted quota
+    quota_used_up = False
+    detail_calls = []
+    active = 0
+    peak = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path.endswith('/findByIngredients'):
+            self.send_json([
+                {'id': i, 'title': f'Dish {i}', 'image': None, 'usedIngredientCount': 1,
+                 'missedIngredientCount': 0, 'missedIngredients': []}
+                for i in range(1, RECIPES + 1)
+            ])
+            return
+
+        recipe_id = int(path.split('/')[2])
+        cls = type(self)
+        with cls.lock:
+            cls.detail_calls.append(recipe_id)
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+        try:
+            time.sleep(CALL_TIMEOUT * 3 if recipe_id == HANGING_ID else DELAY)
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+        if cls.quota_used_up:
+            self.send_response(402)
+            self.end_headers()
+        elif recipe_id == FAILING_ID:
+            self.send_response(500)
+            self.end_headers()
+        elif recipe_id == BAD_JSON_ID:
+            self.send_json([])
+        else:
+            self.send_json({
+                'readyInMinutes': 20 + recipe_id,
+                'servings': 2,
+                'pricePerServing': 150,
+                'analyzedInstructions': [{'steps': [{'step': 'Chop'}, {'step': 'Cook'}]}],
+                'nutrition': {'nutrients': [{'name': 'Calories', 'amount': 412.3, 'unit': 'kcal'}]},
+            })
+
+    def send_json(self, body):
+        data = json.dumps(body).encode()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client already gave up on this call
+            pass
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeSpoonacular)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Configure the app before importing it, and keep its SQLite file out of the repo.
+    # An empty DATABASE_URL means SQLite, and load_dotenv() won't replace it
+    # with one from a developer's .env.
+    os.environ['SPOONACULAR_BASE_URL'] = f'http://127.0.0.1:{server.server_port}'
+    os.environ['RECIPE_DETAIL_TIMEOUT'] = str(CALL_TIMEOUT)
+    os.environ['DATABASE_URL'] = ''
+    os.chdir(tempfile.mkdtemp())
+
+    import app
+    import queries
+    import recipe_details
+    assert queries.DIALECT == 'sqlite', queries.DIALECT
+
+    client = app.app.test_client()
+    client.post('/add', data={'item_name': 'Milk', 'quantity': '1', 'category': 'Dairy',
+                              'expiration_date': '2030-01-01', 'location': 'Fridge'})
+
+    start = time.perf_counter()
+    response = client.get('/recipes')
+    first_view = time.perf_counter() - start
+    html = response.data.decode()
+
+    assert response.status_code == 200, response.status_code
+    assert len(FakeSpoonacular.detail_calls) == RECIPES
+    assert 1 < FakeSpoonacular.peak <= recipe_details.MAX_WORKERS, FakeSpoonacular.peak
+    # Serially the healthy calls alone would take RECIPES * DELAY
+    assert first_view < CALL_TIMEOUT + 2 * DELAY + 0.5, first_view
+    assert html.count('Instructions (2 steps)') == RECIPES - len(BROKEN_IDS)
+    print(f'first view: {first_view:.2f}s, {len(FakeSpoonacular.detail_calls)} detail calls, '
+          f'peak {FakeSpoonacular.peak} at once (limit {recipe_details.MAX_WORKERS})')
+
+    FakeSpoonacular.detail_calls.clear()
+    start = time.perf_counter()
+    response = client.get('/recipes')
+    second_view = time.perf_counter() - start
+
+    assert response.status_code == 200, response.status_code
+    # Cached recipes come from the database, failed ones are cooling down
+    assert FakeSpoonacular.detail_calls == [], FakeSpoonacular.detail_calls
+    print(f'second view: {second_view:.2f}s, no detail calls')
+
+    # Once the failure cooldown is over, only the failed recipes are retried.
+    # This time the quota is used up, so every call gets a 402.
+    recipe_details._failed_until.clear()
+    FakeSpoonacular.quota_used_up = True
+    client.get('/recipes')
+    assert set(FakeSpoonacular.detail_calls) == BROKEN_IDS, FakeSpoonacular.detail_calls
+
+    # After a 402 no detail calls are made at all, even for recipes whose own
+    # cooldown is over
+    FakeSpoonacular.detail_calls.clear()
+    recipe_details._failed_until.clear()
+    response = client.get('/recipes')
+    assert response.status_code == 200, response.status_code
+    assert FakeSpoonacular.detail_calls == [], FakeSpoonacular.detail_calls
+    print(f'after a 402: retried {sorted(BROKEN_IDS)} once, then no detail calls')
+
+    server.shutdown()
+    print('ok')
+
+
+if __name__ == '__main__':
+    main()
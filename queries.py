@@ -0,0 +1,304 @@
+"""Database connections and every SQL statement the app runs.
+
+Statements are written once with :name placeholders and compiled for both
+SQLite and PostgreSQL when this module is imported. On PostgreSQL each
+statement is prepared server-side the first time a pooled connection runs
+it. On SQLite a few connections are kept open and shared between
+requests, so sqlite3's own statement cache stays warm.
+"""
+from dataclasses import dataclass, field, fields
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Check if we're on Render (production) or local (development)
+DATABASE_URL = os.getenv('DATABASE_URL')
+DIALECT = 'postgres' if DATABASE_URL else 'sqlite'
+
+SQLITE_PATH = 'fridge.db'
+
+
+# Typed rows, in the same column order the SELECT statements use.
+# Fields with metadata={'column': False} are not selected from the database.
+
+@dataclass
+class FridgeItem:
+    id: int
+    name: str
+    quantity: int
+    category: str
+    expiration: str
+    location: str
+    status: str
+    price: float
+    store: str
+    # Filled in by the home page, not stored in the database
+    days_left: int = field(default=None, metadata={'column': False})
+
+
+@dataclass
+class PriceRecord:
+    id: int
+    item_name: str
+    store: str
+    price: float
+    date_recorded: str
+    notes: str
+
+
+@dataclass
+class ItemStore:
+    item_name: str
+    store: str
+
+
+@dataclass
+class RecipeDetail:
+    recipe_id: int
+    data: str
+    fetched_at: str
+
+
+def _columns(row_type):
+    return ', '.join(f.name for f in fields(row_type) if f.metadata.get('column', True))
+
+
+_PLACEHOLDER = re.compile(r'(?<![:\w]):(\w+)')
+
+
+def _json_list(value):
+    return json.dumps(list(value))
+
+
+# How list parameters are sent: a JSON array for SQLite's json_each(), a
+# plain list (adapted to an ARRAY) for PostgreSQL
+_LIST_VALUE = _json_list if DIALECT == 'sqlite' else list
+
+
+class Statement:
+    """One SQL statement, compiled for every dialect up front.
+
+    Parameters named in `lists` take a list of values and must be written
+    as `column IN (:name)`. They are passed as a JSON array to SQLite and as
+    an array to PostgreSQL, so the statement text never changes with the
+    list length.
+    """
+
+    def __init__(self, name, sql, row=None, lists=()):
+        self.name = name
+        self.row = row
+        self.lists = set(lists)
+        if row is not None:
+            sql = sql.replace('{columns}', _columns(row))
+
+        # Parameter names in the order they appear in the SQL
+        self.params = _PLACEHOLDER.findall(sql)
+
+        sqlite_sql = sql
+        postgres_sql = sql
+        for list_name in self.lists:
+            sqlite_sql = sqlite_sql.replace(f'IN (:{list_name})',
+                                            f'IN (SELECT value FROM json_each(:{list_name}))')
+            postgres_sql = postgres_sql.replace(f'IN (:{list_name})', f'= ANY(:{list_name})')
+
+        self.sqlite_sql = _PLACEHOLDER.sub('?', sqlite_sql)
+
+        numbers = iter(range(1, len(self.params) + 1))
+        self.prepare_sql = f'PREPARE {name} AS ' + _PLACEHOLDER.sub(lambda m: f'${next(numbers)}', postgres_sql)
+        if self.params:
+            self.execute_sql = f'EXECUTE {name} (' + ', '.join(['%s'] * len(self.params)) + ')'
+        else:
+            self.execute_sql = f'EXECUTE {name}'
+
+        # (name, encoder) per parameter, fixed for the active dialect
+        self._encoders = tuple((param, _LIST_VALUE if param in self.lists else None)
+                               for param in self.params)
+
+    def values(self, params):
+        if not self.lists:
+            return tuple(params[name] for name in self.params)
+        return tuple(params[name] if encode is None else encode(params[name])
+                     for name, encode in self._encoders)
+
+
+# Fridge items
+
+FRIDGE_ITEMS = Statement('fridge_items', '''
+    SELECT {columns} FROM fridge_items
+    WHERE status = 'fridge'
+    ORDER BY expiration''', row=FridgeItem)
+
+SHOPPING_LIST_ITEMS = Statement('shopping_list_items', '''
+    SELECT {columns} FROM fridge_items
+    WHERE status = 'shopping_list' ''', row=FridgeItem)
+
+GET_ITEM = Statement('get_item', '''
+    SELECT {columns} FROM fridge_items
+    WHERE id = :id''', row=FridgeItem)
+
+SHOPPING_ITEM_BY_NAME = Statement('shopping_item_by_name', '''
+    SELECT id FROM fridge_items
+    WHERE name = :name AND status = 'shopping_list' ''')
+
+INSERT_ITEM = Statement('insert_item', '''
+    INSERT INTO fridge_items
+    (name, quantity, category, expiration, location, status, price, store)
+    VALUES (:name, :quantity, :category, :expiration, :location, :status, :price, :store)''')
+
+UPDATE_ITEM = Statement('update_item', '''
+    UPDATE fridge_items
+    SET name = :name, quantity = :quantity, category = :category, expiration = :expiration,
+        location = :location, price = :price, store = :store
+    WHERE id = :id''')
+
+SET_ITEM_STATUS = Statement('set_item_status', '''
+    UPDATE fridge_items SET status = :status WHERE id = :id''')
+
+DELETE_ITEM = Statement('delete_item', '''
+    DELETE FROM fridge_items WHERE id = :id''')
+
+# Price history
+
+INSERT_PRICE = Statement('insert_price', '''
+    INSERT INTO price_history (item_name, store, price, date_recorded)
+    VALUES (:item_name, :store, :price, :date_recorded)''')
+
+PRICE_HISTORY = Statement('price_history', '''
+    SELECT {columns} FROM price_history
+    ORDER BY date_recorded DESC''', row=PriceRecord)
+
+PRICES_SINCE = Statement('prices_since', '''
+    SELECT {columns} FROM price_history
+    WHERE id > :last_id
+    ORDER BY id''', row=PriceRecord)
+
+PRICED_ITEM_STORES = Statement('priced_item_stores', '''
+    SELECT DISTINCT item_name, store
+    FROM price_history
+    ORDER BY item_name''', row=ItemStore)
+
+PRICES_FOR_ITEM_AT_STORE = Statement('prices_for_item_at_store', '''
+    SELECT {columns} FROM price_history
+    WHERE item_name = :item_name AND store = :store
+    ORDER BY date_recorded DESC''', row=PriceRecord)
+
+# Recipe details fetched from Spoonacular
+
+GET_RECIPE_DETAILS = Statement('get_recipe_details', '''
+    SELECT {columns} FROM recipe_details
+    WHERE recipe_id IN (:recipe_ids)''', row=RecipeDetail, lists=('recipe_ids',))
+
+SAVE_RECIPE_DETAIL = Statement('save_recipe_detail', '''
+    INSERT INTO recipe_details (recipe_id, data, fetched_at)
+    VALUES (:recipe_id, :data, :fetched_at)
+    ON CONFLICT (recipe_id) DO NOTHING''')
+
+
+# Connections
+
+if DIALECT == 'postgres':
+    # Production: Use PostgreSQL
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.pool
+
+    # Keep this at least as large as the number of request threads; extra
+    # requests wait for a free connection instead of failing.
+    POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+
+    class PreparedConnection(psycopg2.extensions.connection):
+        """psycopg2 connection that remembers which statements it has prepared"""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.prepared = set()
+
+    _pool = None
+    _pool_lock = threading.Lock()
+    # getconn() raises PoolError when every connection is in use, so
+    # requests queue on this semaphore first
+    _pool_slots = threading.BoundedSemaphore(POOL_SIZE)
+
+    def get_db_connection():
+        global _pool
+        if _pool is None:
+            with _pool_lock:
+                if _pool is None:
+                    _pool = psycopg2.pool.ThreadedConnectionPool(
+                        1, POOL_SIZE, DATABASE_URL,
+                        connection_factory=PreparedConnection)
+
+        _pool_slots.acquire()
+        try:
+            conn = _pool.getconn()
+            # Drop connections that were closed since they were last used
+            while conn.closed:
+                _pool.putconn(conn, close=True)
+                conn = _pool.getconn()
+            return conn
+        except Exception:
+            _pool_slots.release()
+            raise
+
+    def release_db_connection(conn):
+        """Hand the connection back to the pool (uncommitted work is rolled back)"""
+        try:
+            _pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            _pool_slots.release()
+
+    def _run(conn, statement, params):
+        cursor = conn.cursor()
+        if statement.name not in conn.prepared:
+            cursor.execute(statement.prepare_sql)
+            conn.prepared.add(statement.name)
+        cursor.execute(statement.execute_sql, statement.values(params))
+        return cursor
+else:
+    # Development: Use SQLite
+    POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+
+    # The dev server starts a new thread for every request, so connections
+    # are shared between threads (one request at a time) rather than kept
+    # per thread
+    _idle = queue.LifoQueue()
+
+    def get_db_connection():
+        try:
+            return _idle.get_nowait()
+        except queue.Empty:
+            return sqlite3.connect(SQLITE_PATH, cached_statements=256, check_same_thread=False)
+
+    def release_db_connection(conn):
+        """Keep the connection open for the next request, dropping uncommitted work"""
+        conn.rollback()
+        if _idle.qsize() < POOL_SIZE:
+            _idle.put(conn)
+        else:
+            conn.close()
+
+    def _run(conn, statement, params):
+        return conn.execute(statement.sqlite_sql, statement.values(params))
+
+
+def query(conn, statement, **params):
+    """Run a SELECT statement and return its rows (typed if the statement has a row type)"""
+    cursor = _run(conn, statement, params)
+    rows = cursor.fetchall()
+    cursor.close()
+    if statement.row is None:
+        return rows
+    row = statement.row
+    return [row(*values) for values in rows]
+
+
+def execute(conn, statement, **params):
+    """Run an INSERT/UPDATE/DELETE statement"""
+    _run(conn, statement, params).close()
@@ -0,0 +1,183 @@
+"""Recipe details (instructions, nutrition, price per serving) from Spoonacular.
+
+findByIngredients only returns a short summary, so every recipe needs its
+own /information call. Missing recipes are fetched at the same time on a
+small thread pool and saved in the recipe_details table, so a recipe is
+only ever fetched once. Failed recipes are skipped for a while, and the
+whole API is skipped for longer once the daily quota is used up.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+import json
+import os
+import threading
+import time
+
+import requests
+
+import queries
+
+# How many detail calls can be in flight at once
+MAX_WORKERS = int(os.getenv('RECIPE_DETAIL_WORKERS', 6))
+# Seconds allowed for one detail call, and for the whole batch
+CALL_TIMEOUT = float(os.getenv('RECIPE_DETAIL_TIMEOUT', 5))
+BATCH_TIMEOUT = float(os.getenv('RECIPE_DETAIL_BATCH_TIMEOUT', 8))
+# Seconds to skip a recipe whose detail call failed, and to skip every call
+# after Spoonacular says the quota is used up (402) or we are rate limited (429)
+FAILURE_COOLDOWN = float(os.getenv('RECIPE_DETAIL_FAILURE_COOLDOWN', 300))
+QUOTA_COOLDOWN = float(os.getenv('RECIPE_DETAIL_QUOTA_COOLDOWN', 3600))
+QUOTA_STATUSES = (402, 429)
+
+NUTRIENTS = ('Calories', 'Protein', 'Fat', 'Carbohydrates')
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='recipe-details')
+_local = threading.local()
+
+_cooldown_lock = threading.Lock()
+_failed_until = {}         # recipe_id -> time.monotonic() when it may be tried again
+_api_blocked_until = 0.0   # time.monotonic() when the API may be called again
+
+
+def _session():
+    """One requests session per worker thread, so connections get reused"""
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        _local.session = session
+    return session
+
+
+def summarize(info):
+    """Keep only the parts of /information the recipes page shows"""
+    if not isinstance(info, dict):
+        return None
+
+    steps = []
+    for instruction in info.get('analyzedInstructions') or []:
+        steps.extend(step['step'] for step in instruction.get('steps', []))
+
+    nutrition = {}
+    for nutrient in (info.get('nutrition') or {}).get('nutrients', []):
+        if nutrient.get('name') in NUTRIENTS:
+            nutrition[nutrient['name']] = f"{round(nutrient['amount'])}{nutrient.get('unit', '')}"
+
+    price = info.get('pricePerServing')
+    return {
+        'ready_in_minutes': info.get('readyInMinutes'),
+        'servings': info.get('servings'),
+        # Spoonacular reports price per serving in cents
+        'price_per_serving': round(price / 100, 2) if price is not None else None,
+        'nutrition': nutrition,
+        'steps': steps,
+        'source_url': info.get('sourceUrl'),
+    }
+
+
+def _record_failure(recipe_id, status=None):
+    global _api_blocked_until
+    now = time.monotonic()
+    with _cooldown_lock:
+        _failed_until[recipe_id] = now + FAILURE_COOLDOWN
+        if status in QUOTA_STATUSES:
+            _api_blocked_until = now + QUOTA_COOLDOWN
+
+
+def _ready_to_fetch(recipe_ids):
+    """Drop recipes still cooling down after a failure (or all of them if the API is)"""
+    now = time.monotonic()
+    with _cooldown_lock:
+        if now < _api_blocked_until:
+            return []
+        for recipe_id, until in list(_failed_until.items()):
+            if until <= now:
+                del _failed_until[recipe_id]
+        return [recipe_id for recipe_id in recipe_ids if recipe_id not in _failed_until]
+
+
+def fetch_recipe_detail(recipe_id, api_key, base_url):
+    """Fetch one recipe's details, or None if the call fails or times out"""
+    url = f'{base_url}/recipes/{recipe_id}/information'
+    params = {'includeNutrition': True, 'apiKey': api_key}
+
+    status = None
+    try:
+        response = _session().get(url, params=params, timeout=CALL_TIMEOUT)
+        status = response.status_code
+        if status == 200:
+            details = summarize(response.json())
+            if details is not None:
+                return details
+    except Exception:
+        pass
+
+    _record_failure(recipe_id, status)
+    return None
+
+
+def fetch_recipe_details(recipe_ids, api_key, base_url):
+    """Fetch details for several recipes concurrently.
+
+    Returns {recipe_id: details} for the calls that finished in time.
+    Calls still running after BATCH_TIMEOUT are left behind, and recipes
+    cooling down after a failure are not asked for.
+    """
+    recipe_ids = _ready_to_fetch(recipe_ids)
+    futures = {
+        _executor.submit(fetch_recipe_detail, recipe_id, api_key, base_url): recipe_id
+        for recipe_id in recipe_ids
+    }
+    if not futures:
+        return {}
+
+    done, not_done = wait(futures, timeout=BATCH_TIMEOUT)
+    for future in not_done:
+        future.cancel()
+
+    details = {}
+    for future in done:
+        try:
+            result = future.result()
+        except Exception:
+            continue
+        if result is not None:
+            details[futures[future]] = result
+    return details
+
+
+def get_recipe_details(recipe_ids, api_key, base_url):
+    """Return {recipe_id: details}, fetching only the recipes not cached yet.
+
+    A database connection is only held while reading and writing the cache,
+    never while waiting on the API.
+    """
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+    if not recipe_ids:
+        return {}
+
+    conn = queries.get_db_connection()
+    try:
+        cached = queries.query(conn, queries.GET_RECIPE_DETAILS, recipe_ids=recipe_ids)
+    finally:
+        queries.release_db_connection(conn)
+
+    details = {row.recipe_id: json.loads(row.data) for row in cached}
+    missing = [recipe_id for recipe_id in recipe_ids if recipe_id not in details]
+    if not missing:
+        return details
+
+    fetched = fetch_recipe_details(missing, api_key, base_url)
+    if not fetched:
+        return details
+
+    fetched_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn = queries.get_db_connection()
+    try:
+        for recipe_id, detail in fetched.items():
+            queries.execute(conn, queries.SAVE_RECIPE_DETAIL,
+                            recipe_id=recipe_id, data=json.dumps(detail), fetched_at=fetched_at)
+        conn.commit()
+    finally:
+        queries.release_db_connection(conn)
+
+    details.update(fetched)
+    return details
@@ -0,0 +1,251 @@
+"""Shopping trip planner built on the latest prices in price_history"""
+from itertools import combinations
+import threading
+
+
+def normalize_name(name):
+    """Match item names regardless of case and extra whitespace"""
+    return ' '.join((name or '').split()).lower()
+
+
+def _quantity(value):
+    """Quantities come from form input, so fall back to 1 if they don't parse"""
+    try:
+        return max(int(value), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+class PriceIndex:
+    """Latest known price for every (item_name, store) pair"""
+
+    def __init__(self):
+        # item key -> {store: (date_recorded, id, price)}
+        self.prices = {}
+        # Highest price_history id seen, so refreshes only load new rows
+        self.last_id = 0
+
+    def add_rows(self, rows):
+        """Fold price_history rows into the index.
+
+        Rows already in the index are ignored, so overlapping refreshes are
+        safe. Returns the set of (item key, store) pairs whose latest price
+        changed.
+        """
+        changed = set()
+        for row in rows:
+            self.last_id = max(self.last_id, row.id)
+            store = row.store
+            if not store:
+                continue
+
+            key = normalize_name(row.item_name)
+            by_store = self.prices.setdefault(key, {})
+            current = by_store.get(store)
+
+            # Newest date wins, ties go to the row inserted last
+            if current is None or (row.date_recorded, row.id) > current[:2]:
+                by_store[store] = (row.date_recorded, row.id, row.price)
+                changed.add((key, store))
+        return changed
+
+    def store_prices(self, key):
+        """Return {store: latest price} for one item key"""
+        return {store: entry[2] for store, entry in self.prices.get(key, {}).items()}
+
+
+class ShoppingPlanner:
+    """Cheapest store assignment and one/two-store trips for a shopping list.
+
+    Everything the plan needs is kept up to date as prices arrive: each
+    store's costs and total, each item's cheapest store, and for every pair
+    of stores how many listed items they share and what the dearer copies of
+    those items cost. A price change only touches the item it is for, so
+    replanning never rescans the whole list. Adding or removing a list item
+    likewise only touches that item. The finished plan is cached
+    until either the list or one of its prices changes.
+    """
+
+    def __init__(self, index=None):
+        self.index = index or PriceIndex()
+        self._lock = threading.Lock()
+        self._signature = None
+        self._quantities = {}    # item key -> quantity on the list
+        self._names = {}         # item key -> name as shown on the list
+        self._store_costs = {}   # store -> {item key: price * quantity}
+        self._store_totals = {}  # store -> sum of its item costs
+        self._item_costs = {}    # item key -> {store: price * quantity}
+        self._cheapest = {}      # item key -> (cost, store)
+        self._pair_shared = {}   # (store, store) -> items sold at both
+        self._pair_overlap = {}  # (store, store) -> sum of the dearer costs of those items
+        self._plan = None
+
+    def apply_prices(self, rows):
+        """Add new price_history rows and update cached costs for listed items"""
+        with self._lock:
+            changed = self.index.add_rows(rows)
+            for key, store in changed:
+                quantity = self._quantities.get(key)
+                if quantity is None:
+                    continue
+                self._set_cost(store, key, self.index.prices[key][store][2] * quantity)
+            return changed
+
+    def plan(self, items):
+        """Plan a trip for shopping list rows (rows with name and quantity)"""
+        with self._lock:
+            self._load_list(items)
+            if self._plan is None:
+                self._plan = self._build_plan()
+            return self._plan
+
+    def _set_cost(self, store, key, cost):
+        """Record one item's cost at one store and update everything derived from it"""
+        costs = self._store_costs.setdefault(store, {})
+        old = costs.get(key)
+        self._store_totals[store] = self._store_totals.get(store, 0) + cost - (old or 0)
+        costs[key] = cost
+
+        by_store = self._item_costs.setdefault(key, {})
+        for other, other_cost in by_store.items():
+            if other == store:
+                continue
+            pair = (store, other) if store < other else (other, store)
+            if old is None:
+                self._pair_shared[pair] = self._pair_shared.get(pair, 0) + 1
+                self._pair_overlap[pair] = self._pair_overlap.get(pair, 0) + max(cost, other_cost)
+            else:
+                self._pair_overlap[pair] += max(cost, other_cost) - max(old, other_cost)
+        by_store[store] = cost
+
+        cheapest = self._cheapest.get(key)
+        if cheapest is None or (cost, store) < cheapest:
+            self._cheapest[key] = (cost, store)
+        elif cheapest[1] == store:
+            # The cheapest store got dearer, so look at the item's other stores
+            self._cheapest[key] = min((c, s) for s, c in by_store.items())
+
+        self._plan = None
+
+    def _drop_item(self, key):
+        """Take one item out of every store total, pair and cheapest-store entry"""
+        by_store = self._item_costs.pop(key, {})
+        self._cheapest.pop(key, None)
+        for store, cost in by_store.items():
+            costs = self._store_costs[store]
+            del costs[key]
+            if costs:
+                self._store_totals[store] -= cost
+            else:
+                del self._store_costs[store]
+                del self._store_totals[store]
+
+        for pair in combinations(sorted(by_store), 2):
+            a, b = pair
+            shared = self._pair_shared[pair] - 1
+            if shared:
+                self._pair_shared[pair] = shared
+                self._pair_overlap[pair] -= max(by_store[a], by_store[b])
+            else:
+                del self._pair_shared[pair]
+                del self._pair_overlap[pair]
+        self._plan = None
+
+    def _add_item(self, key, quantity):
+        for store, price in self.index.store_prices(key).items():
+            self._set_cost(store, key, price * quantity)
+
+    def _load_list(self, items):
+        """Update per-store costs for the items added to or removed from the list"""
+        quantities = {}
+        names = {}
+        for item in items:
+            key = normalize_name(item.name)
+            if not key:
+                continue
+            quantities[key] = quantities.get(key, 0) + _quantity(item.quantity)
+            names.setdefault(key, item.name)
+
+        signature = tuple(sorted(quantities.items()))
+        if signature == self._signature:
+            return
+
+        # Only items that are new, gone or have a new quantity are touched
+        old = self._quantities
+        for key, quantity in old.items():
+            if quantities.get(key) != quantity:
+                self._drop_item(key)
+        for key, quantity in quantities.items():
+            if old.get(key) != quantity:
+                self._add_item(key, quantity)
+
+        self._signature = signature
+        self._quantities = quantities
+        self._names = names
+        self._plan = None
+
+    def _trip(self, stores, covered, total):
+        missing = [self._names[key] for key in self._quantities
+                   if not any(key in self._store_costs[store] for store in stores)]
+        return {
+            'stores': list(stores),
+            'total': round(total, 2),
+            'covered': covered,
+            'missing': sorted(missing),
+        }
+
+    def _build_plan(self):
+        assignments = []
+        unpriced = []
+        for key, quantity in self._quantities.items():
+            cheapest = self._cheapest.get(key)
+            if cheapest is None:
+                unpriced.append(self._names[key])
+                continue
+            cost, store = cheapest
+            assignments.append({
+                'name': self._names[key],
+                'quantity': quantity,
+                'store': store,
+                'unit_price': self.index.prices[key][store][2],
+                'cost': round(cost, 2),
+            })
+        assignments.sort(key=lambda a: (a['store'], a['name']))
+
+        stores = sorted(self._store_costs)
+
+        # Best trip covers the most items, then costs the least
+        one_store = None
+        for store in stores:
+            rank = (-len(self._store_costs[store]), self._store_totals[store])
+            if one_store is None or rank < one_store:
+                one_store = rank
+                one_store_name = store
+
+        two_store = None
+        for pair in combinations(stores, 2):
+            a, b = pair
+            covered = (len(self._store_costs[a]) + len(self._store_costs[b])
+                       - self._pair_shared.get(pair, 0))
+            total = (self._store_totals[a] + self._store_totals[b]
+                     - self._pair_overlap.get(pair, 0))
+            rank = (-covered, total)
+            if two_store is None or rank < two_store:
+                two_store = rank
+                two_store_names = pair
+
+        plan = {
+            'assignments': assignments,
+            'cheapest_total': round(sum(a['cost'] for a in assignments), 2),
+            'unpriced': sorted(unpriced),
+            'one_store': None,
+            'two_store': None,
+        }
+        if one_store:
+            plan['one_store'] = self._trip((one_store_name,), -one_store[0], one_store[1])
+
+            # A second stop is only worth it if it buys more items or saves money
+            if two_store and (two_store[0] < one_store[0]
+                              or round(two_store[1], 2) < round(one_store[1], 2)):
+                plan['two_store'] = self._trip(two_store_names, -two_store[0], two_store[1])
+        return plan